@@ -1,17 +1,27 @@
 import os
+import stat
 import argparse
 import logging
 from jsmin import jsmin
 from csscompressor import compress as cssmin
 from htmlmin import minify as htmlmin
 from pyminifier import minification as pymin
-from concurrent.futures import ThreadPoolExecutor, as_completed
+try:
+    import python_minifier
+except ImportError:
+    python_minifier = None
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+import multiprocessing
 from tqdm import tqdm
 import magic
 from jinja2 import Environment, FileSystemLoader
 import markdown
 import pdfkit
 import tempfile
+import hashlib
+import codecs
 from git import Repo
 from git.exc import GitCommandError
 from typing import List, Optional
@@ -56,6 +66,24 @@ file_types = {
     ".ps1": "powershell",
 }
 
+# Shared libmagic detector, only consulted for extensions missing from file_types
+mime_magic = magic.Magic(mime=True)
+
+# Source files are read in one go through a large buffer and decoded once
+read_buffer_size = 128 * 1024
+# The merged output is written through a large buffer, one chunk per file
+write_buffer_size = 1 << 20
+# Code fences inside a file are broken up so they cannot close the surrounding block.
+# A plain str.replace is used for this: it beats both re.sub and textwrap.indent on large inputs
+code_fence = "```"
+escaped_code_fence = "` ` `"
+code_fence_bytes = code_fence.encode('utf-8')
+
+# Files are handed to the workers in batches to amortise dispatch overhead
+batch_size = 32
+# Reading is I/O bound, so one oversized thread pool is shared by every run
+io_pool = ThreadPoolExecutor(max_workers=min(64, (os.cpu_count() or 4) * 8), thread_name_prefix='sm-io')
+
 def clone_repository(repo_url: str, branch: Optional[str] = None, temp_dir: str = None) -> str:
     """
     Clone a remote repository to a temporary directory.
@@ -96,90 +124,120 @@ def process_remote_repository(**kwargs) -> None:
     except Exception as e:
         print(f"An error occurred: {e}")
 
-def processFile(filename, extensions, minify):
-    if any(filename.endswith(ext) for ext in extensions):
+def readFileBytes(file_path):
+    with open(file_path, "rb", buffering=read_buffer_size) as f:
+        return f.read()
+
+def decodeFileContents(data):
+    # Returns the decoded text, plus the raw bytes when they are exactly that text encoded as UTF-8
+    # UTF-16 is only trusted when the file says so, anything else is UTF-8 with bad bytes replaced
+    if data.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        file_contents = data.decode('utf-16', errors='ignore')
+        data = None
+        has_carriage_return = '\r' in file_contents
+    else:
+        # A UTF-8 '\r' is always the single byte 0x0d, so the raw bytes can be searched directly
+        has_carriage_return = b'\r' in data
         try:
-            with open(filename, "r", encoding='utf-8', errors="ignore") as f:
-                file_contents = f.readlines()
-                if minify:
-                    file_contents = [compressCode(line, getFileType(filename)) for line in file_contents]
-                return filename, ''.join(file_contents)
+            file_contents = data.decode('utf-8')
         except UnicodeDecodeError:
-            try:
-                with open(filename,
-                            "r",
-                            encoding='utf-16',
-                            errors="ignore") as f:
-                        file_contents = f.readlines()
-                        if minify:
-                            file_contents = [compressCode(line, getFileType(filename)) for line in file_contents]
-                        return filename, ''.join(file_contents)
-            except Exception as e:
-                logger.error(f"Error processing file {filename}: {e}")
-    return None, None
+            file_contents = data.decode('utf-8', errors='replace')
+            data = None
+    # Match the newline translation of text mode reads, most files have nothing to translate
+    if has_carriage_return:
+        file_contents = file_contents.replace('\r\n', '\n').replace('\r', '\n')
+        data = None
+    return file_contents, data
 
-def getFileType(file_path):
+def processFile(filename, minify, base_dir, output_format):
+    try:
+        # The file is read once, type detection works on the same bytes
+        data = readFileBytes(filename)
+        file_type = getFileType(filename, data)
+        file_contents, data = decodeFileContents(data)
+        if minify:
+            file_contents = compressCode(file_contents, file_type)
+            data = None
+        # Text outputs are formatted and encoded here so the writer only has to concatenate bytes
+        chunk = None
+        if file_type and output_format in ['markdown', 'md', 'txt']:
+            relative_path = os.path.relpath(filename, base_dir)
+            if data is not None and output_format in ['markdown', 'md'] and file_type != "txt" and code_fence_bytes not in data:
+                chunk = formatCodeBlock(data, file_type, relative_path)
+            else:
+                chunk = formatFileContents(file_contents, file_type, relative_path, output_format).encode('utf-8')
+        # Hashed here because hashlib releases the GIL, so digests are computed in parallel
+        if data is None:
+            data = file_contents.encode('utf-8', 'replace')
+        content_hash = hashlib.blake2b(data, digest_size=16).digest()
+        # Once the block is built the text is no longer needed, so it is not kept alive or pickled back
+        if chunk is not None:
+            file_contents = None
+        return filename, file_type, file_contents, chunk, content_hash
+    except Exception as e:
+        logger.error(f"Error processing file {filename}: {e}")
+    return None, None, None, None, None
+
+def normalizeExtension(ext):
+    ext = ext.lower()
+    return ext if ext.startswith('.') else f".{ext}"
+
+def processFiles(filenames, minify, base_dir, output_format):
+    return [processFile(filename, minify, base_dir, output_format) for filename in filenames]
+
+def batchFiles(file_paths, size):
+    batch = []
+    for file_path in file_paths:
+        batch.append(file_path)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def getFileType(file_path, data):
     # First, try to determine the file type by extension
-    file_type = os.path.splitext(file_path)[-1].lower()
-    if file_type in file_types:
-        return file_types[file_type]
+    file_type = file_types.get(os.path.splitext(file_path)[-1].lower())
+    if file_type:
+        return file_type
     
-    # If that fails, use libmagic to determine the file type
+    # If that fails, use libmagic on the bytes the caller already read
     try:
-        mime = magic.Magic(mime=True)
-        file_mime = mime.from_file(file_path)
+        file_mime = mime_magic.from_buffer(data)
         if 'text' in file_mime:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read(1024)  # Read first 1024 bytes
-                if '<?php' in content:
-                    return 'php'
-                elif '#!/usr/bin/env python' in content or 'import ' in content:
-                    return 'python'
-                elif '<html' in content.lower():
-                    return 'HTML'
-                elif '{' in content and '}' in content:
-                    return 'json'
+            # Byte probes on the first 512 raw bytes are enough, no need to decode the text
+            content = data[:512]
+            if b'<?php' in content:
+                return 'php'
+            elif b'#!/usr/bin/env python' in content or b'import ' in content:
+                return 'python'
+            elif b'<html' in content.lower():
+                return 'HTML'
+            elif b'{' in content and b'}' in content:
+                return 'json'
         return 'text'  # Default to text if we can't determine a more specific type
     except Exception as e:
         logger.error(f"Error determining file type for {file_path}: {e}")
         return None
 
-def writeFileContents(output_file, file_contents, file_type, relative_path, output_format, minify):
-    if minify:
-        file_contents = compressCode(file_contents, file_type)
-    
+def formatFileContents(file_contents, file_type, relative_path, output_format):
     if output_format in ['markdown', 'md']:
-        output_file.write(f"## {relative_path}\n\n")
         if file_type == "txt":
-            output_file.write(f"> {file_contents.replace('\n', '\n>\n> ')}\n\n")
-        else:
-            file_contents = file_contents.replace("```", "` ` `")
-            output_file.write(f"```{file_type}\n{file_contents}\n```\n\n")
+            quoted = file_contents.replace('\n', '\n>\n> ')
+            return f"## {relative_path}\n\n> {quoted}\n\n"
+        file_contents = file_contents.replace(code_fence, escaped_code_fence)
+        return f"## {relative_path}\n\n```{file_type}\n{file_contents}\n```\n\n"
     elif output_format == 'html':
-        output_file.write(f"<h2>{relative_path}</h2>\n")
-        output_file.write(f"<pre><code class='{file_type}'>{file_contents}</code></pre>\n")
+        return f"<h2>{relative_path}</h2>\n<pre><code class='{file_type}'>{file_contents}</code></pre>\n"
     elif output_format == 'txt':
-        output_file.write(f"{relative_path}:\n")
-        output_file.write(f"\t{file_contents.replace('\n', '\n\t')}\n\n")
+        indented = file_contents.replace('\n', '\n\t')
+        return f"{relative_path}:\n\t{indented}\n\n"
+    return None
+
+def formatCodeBlock(data, file_type, relative_path):
+    # Same block formatFileContents builds for markdown, with the file's own bytes passed through as the body
+    return b''.join((f"## {relative_path}\n\n```{file_type}\n".encode('utf-8'), data, b"\n```\n\n"))
 
-def writeFileToOutput(file_path, output_file, minify, base_dir, output_format):
-    file_type = getFileType(file_path)
-    if not file_type:
-        return
-    
-    relative_path = os.path.relpath(file_path, base_dir)
-    
-    try:
-        with open(file_path, "r", encoding='utf-8') as f:
-            file_contents = f.read()
-            writeFileContents(output_file, file_contents, file_type, relative_path, output_format, minify)
-    except UnicodeDecodeError:
-        try:
-            with open(file_path, "r", encoding='utf-16', errors='ignore') as f:
-                file_contents = f.read()
-                writeFileContents(output_file, file_contents, file_type, relative_path, output_format, minify)
-        except Exception as e:
-            logger.error(f"Error reading file {file_path}: {e}")
 def compressCode(code, file_type):
     try:
         if file_type == "HTML":
@@ -189,6 +247,13 @@ def compressCode(code, file_type):
         elif file_type == "jsx":
             return jsmin(code)
         elif file_type == "python":
+            # python-minifier parses the source once instead of once per pyminifier pass
+            if python_minifier:
+                try:
+                    return python_minifier.minify(code, remove_annotations=False, remove_literal_statements=True,
+                                                  hoist_literals=False, rename_locals=False)
+                except Exception as e:
+                    logger.warning(f"python-minifier failed, falling back to pyminifier: {e}")
             code = pymin.remove_comments_and_docstrings(code)
             code = pymin.remove_blank_lines(code)
             code = pymin.reduce_operators(code)
@@ -199,11 +264,21 @@ def compressCode(code, file_type):
         logger.error(f"Error compressing code: {e}")
     return code
 
-def filterFiles(files, ignore_files):
-    return [file_path for file_path in files if os.stat(file_path).st_size != 0 and os.path.basename(file_path) not in ignore_files]
-
-def filterDirectories(dirs, ignore_dirs):
-    return [d for d in dirs if d not in ignore_dirs]
+def scanDirectory(path, ignore_dirs, include_name, recursive):
+    # DirEntry caches the file type from the directory listing, so only the size check costs a stat
+    subdirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if recursive and not entry.is_symlink() and entry.name not in ignore_dirs:
+                        subdirs.append(entry.path)
+                elif include_name(entry.name) and entry.is_file() and entry.stat().st_size != 0:
+                    yield entry.path
+    except OSError as e:
+        logger.error(f"Error scanning directory {path}: {e}")
+    for subdir in subdirs:
+        yield from scanDirectory(subdir, ignore_dirs, include_name, recursive)
 
 def findFiles(**kwargs):
     start_dir = kwargs.get('start_dir', '.')
@@ -218,80 +293,107 @@ def findFiles(**kwargs):
     recursive = kwargs.get('recursive', False)
     additionalFiles = kwargs.get('files', [])
     output_format = kwargs.get('output_format', 'txt')
+    open_output = kwargs.get('open', False)
     foundFiles = {}
 
     output_file = os.path.join(out, f"{name}.{output_format}")
-    ignore_files.append(os.path.basename(output_file))
+    # Frozensets keep directory pruning and file filtering at one hash lookup per entry
+    ignore_dirs = frozenset(ignore_dirs)
+    ignore_files = frozenset(ignore_files) | {os.path.basename(output_file)}
 
     if all_types:
         extensions = list(file_types.keys())
-    extensions = [ext for ext in extensions if ext not in exclude_extensions]
+    # Normalised once so most files cost a single set probe instead of one endswith per extension
+    extensions = frozenset(normalizeExtension(ext) for ext in extensions) - frozenset(normalizeExtension(ext) for ext in exclude_extensions)
+    # splitext only sees the last suffix, so entries like '.d.ts' still need an endswith check
+    compound_extensions = tuple(ext for ext in extensions if ext.count('.') > 1)
     
+    # Name based checks come first so files that are filtered out never cost a stat.
+    # Whole names are matched too, so dotfiles like '.env' can be selected
+    def include_name(file_name):
+        if file_name in ignore_files:
+            return False
+        lower_name = file_name.lower()
+        return (os.path.splitext(lower_name)[1] in extensions or
+                lower_name in extensions or
+                lower_name.endswith(compound_extensions))
+
     def should_process_file(file_path):
-        return (os.path.isfile(file_path) and
-                os.stat(file_path).st_size != 0 and
-                os.path.basename(file_path) not in ignore_files and
-                (all_types or any(file_path.endswith(ext) for ext in extensions)))
+        if not include_name(os.path.basename(file_path)):
+            return False
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return False
+        return stat.S_ISREG(st.st_mode) and st.st_size != 0
 
-    all_files = []
-    if recursive:
-        for dirpath, dirs, files in os.walk(start_dir):
-            dirs[:] = [d for d in dirs if d not in ignore_dirs]
-            all_files.extend([os.path.join(dirpath, f) for f in files if should_process_file(os.path.join(dirpath, f))])
-    else:
-        all_files = [os.path.join(start_dir, f) for f in os.listdir(start_dir) if should_process_file(os.path.join(start_dir, f))]
+    def candidate_files():
+        yield from scanDirectory(start_dir, ignore_dirs, include_name, recursive)
+        if additionalFiles:
+            yield from (f for f in additionalFiles if should_process_file(f))
 
-    if additionalFiles:
-        all_files.extend([f for f in additionalFiles if should_process_file(f)])
+    # Batches are submitted while the directory scan is still running, so reads overlap discovery
+    with tqdm(total=0, desc="Processing files", unit="file", colour='green', ncols=100) as pbar:
+        def batches():
+            for batch in batchFiles(candidate_files(), batch_size):
+                pbar.total += len(batch)
+                pbar.refresh()
+                yield batch
 
-    total_files = len(all_files)
-    with tqdm(total=total_files, desc="Processing files", unit="file", colour='green', ncols=100) as pbar:
-        with ThreadPoolExecutor() as executor:
-            future_to_file = {executor.submit(processFile, file_path, extensions, minify): file_path for file_path in all_files}
-            for future in as_completed(future_to_file):
-                file_path = future_to_file[future]
-                try:
-                    filename, file_contents = future.result()
+        # Minifying is CPU bound, so those runs use worker processes to get around the GIL.
+        # They are spawned rather than forked, since the progress bar and io_pool threads may already be running
+        with (ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn')) if minify else nullcontext(io_pool)) as executor:
+            process = partial(processFiles, minify=minify, base_dir=start_dir, output_format=output_format)
+            for results in executor.map(process, batches()):
+                for filename, file_type, file_contents, chunk, content_hash in results:
                     if filename:
-                        foundFiles[filename] = file_contents
-                    pbar.update(1)
-                    pbar.set_postfix_str(f"Current file: {os.path.basename(file_path)}")
-                except Exception as e:
-                    logger.error(f"Error processing file {file_path}: {e}")
+                        foundFiles[filename] = (file_type, file_contents, chunk, content_hash)
+                        pbar.set_postfix_str(f"Current file: {os.path.basename(filename)}")
+                pbar.update(len(results))
 
+    # Duplicates are detected by content digest rather than by rescanning every kept file
     finalFiles = {}
-    for file_path, file_contents in foundFiles.items():
-        if file_contents not in finalFiles.values() and f"{name}.{output_format}" not in file_path:
-            finalFiles[file_path] = file_contents
+    seen_hashes = set()
+    for file_path, (file_type, file_contents, chunk, content_hash) in foundFiles.items():
+        if f"{name}.{output_format}" in file_path:
+            continue
+        if content_hash not in seen_hashes:
+            seen_hashes.add(content_hash)
+            finalFiles[file_path] = (file_type, file_contents, chunk)
 
     try:
         if output_format in ['markdown', 'md']:
-            with open(output_file, "w", encoding='utf-8') as md_file:
-                md_file.write(f"# {name}\n\n")
-                for file_path, file_contents in finalFiles.items():
-                    writeFileToOutput(file_path, md_file, minify, start_dir, output_format)
+            with open(output_file, "wb", buffering=write_buffer_size) as md_file:
+                md_file.write(f"# {name}\n\n".encode('utf-8'))
+                for file_type, file_contents, chunk in finalFiles.values():
+                    if chunk:
+                        md_file.write(chunk)
         elif output_format == 'html':
             env = Environment(loader=FileSystemLoader('.'))
             template = env.get_template('template.html')
             with open(output_file, "w", encoding='utf-8') as html_file:
-                html_content = template.render(title=name, files=finalFiles)
+                files = {file_path: file_contents for file_path, (file_type, file_contents, chunk) in finalFiles.items()}
+                html_content = template.render(title=name, files=files)
                 html_file.write(html_content)
         elif output_format == 'pdf':
-            md_content = f"# {name}\n\n"
-            for file_path, file_contents in finalFiles.items():
-                md_content += f"## {os.path.relpath(file_path, start_dir)}\n\n"
-                md_content += f"```{getFileType(file_path)}\n{file_contents}\n```\n\n"
+            parts = [f"# {name}\n\n"]
+            for file_path, (file_type, file_contents, chunk) in finalFiles.items():
+                parts.append(f"## {os.path.relpath(file_path, start_dir)}\n\n```{file_type}\n{file_contents}\n```\n\n")
+            md_content = ''.join(parts)
             html_content = markdown.markdown(md_content)
             try:
                 pdfkit.from_string(html_content, output_file, configuration=config)
             except Exception as e:
                 logger.error(f"Error converting HTML to PDF: {e}")
         elif output_format == 'txt':
-            with open(output_file, "w", encoding='utf-8') as txt_file:
-                for file_path, file_contents in finalFiles.items():
-                    writeFileToOutput(file_path, txt_file, minify, start_dir, output_format)
+            with open(output_file, "wb", buffering=write_buffer_size) as txt_file:
+                for file_type, file_contents, chunk in finalFiles.values():
+                    if chunk:
+                        txt_file.write(chunk)
         logger.info(f"Output file created: {output_file}")
-        os.startfile(output_file)
+        # Spawning a viewer is only useful interactively, and os.startfile only exists on Windows
+        if open_output and finalFiles and hasattr(os, 'startfile'):
+            os.startfile(output_file)
     except Exception as e:
         logger.error(f"Error writing output file {output_file}: {e}")
 
@@ -312,6 +414,7 @@ def main():
     parser.add_argument('--output_format', choices=['markdown', 'md', 'html', 'pdf', 'txt'], default='txt', help='output format (markdown, html, pdf, or text)')
     parser.add_argument('--repo', type=str, help='URL of the remote Git repository')
     parser.add_argument('--branch', type=str, help='Branch name to checkout (optional)')
+    parser.add_argument('--open', action=argparse.BooleanOptionalAction, default=sys.stdout.isatty(), help='open the output file when done (default: only when run from a terminal)')
     args = parser.parse_args()
     
     if args.Help:
@@ -321,4 +424,5 @@ def main():
     else:
         findFiles(**vars(args))
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file